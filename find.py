@@ -1,49 +1,66 @@
 from jesus import DependencyAnalyzer, ScriptFinder
 from dotenv import load_dotenv
+from types import SimpleNamespace
 import json
 import os
 
-load_dotenv()
+# Worker processes re-import this module, so only the parent loads settings
+# and runs the analysis
+if __name__ == '__main__':
+    load_dotenv()
 
-finder = ScriptFinder()
-json_str = finder.generate_json(os.getenv('BASE_PATH'), "structure.json")
-
-analyzer = DependencyAnalyzer(
-    base_path=os.getenv('BASE_PATH'),
+    # Read settings once instead of calling os.getenv at each use
+    env = SimpleNamespace(**{
+        key: os.getenv(key)
+        for key in ('BASE_PATH', 'DB_DRIVER', 'DB_SERVER', 'DB_PORT', 'DB_NAME', 'DB_USER', 'DB_PASSWORD',
+                    'SCAN_WORKERS')
+    })
     connection_string = (
-    f"DRIVER={{{os.getenv('DB_DRIVER')}}};"
-    f"SERVER={os.getenv('DB_SERVER')},{os.getenv('DB_PORT')};"
-    f"DATABASE={os.getenv('DB_NAME')};"
-    f"UID={os.getenv('DB_USER')};"
-    f"PWD={os.getenv('DB_PASSWORD')}"
-)
-)
+        f"DRIVER={{{env.DB_DRIVER}}};"
+        f"SERVER={env.DB_SERVER},{env.DB_PORT};"
+        f"DATABASE={env.DB_NAME};"
+        f"UID={env.DB_USER};"
+        f"PWD={env.DB_PASSWORD}"
+    )
+
+    finder = ScriptFinder()
+    # Optional: list directories on SCAN_WORKERS threads, for slow or network storage
+    scan_workers = int(env.SCAN_WORKERS) if env.SCAN_WORKERS else None
+    json_str = finder.generate_json(env.BASE_PATH, "structure.json", scan_workers)
+
+    analyzer = DependencyAnalyzer(
+        base_path=env.BASE_PATH,
+        connection_string=connection_string,
+        cache_file='.depcache.pkl'
+    )
 
-# Try database analysis first
-analyzer.analyze_database()
+    # Try database analysis first
+    analyzer.analyze_database()
 
-# Then load structure and analyze files
-with open('structure.json', 'r') as f:
-    structure = json.load(f)
+    # Then load structure and analyze files
+    with open('structure.json', 'r') as f:
+        structure = json.load(f)
 
-for file_info in structure['s']:
-    if file_info['f'].endswith('.py'):
-        analyzer.analyze_file(file_info['p'])
+    analyzer.analyze_files([
+        file_info['p'] for file_info in structure['s']
+        if file_info['f'].endswith('.py')
+    ])
+    analyzer.save_cache()
 
-# Generate outputs
-analyzer.generate_tree_report('dependency_tree.json')
-with open('dependency_tree.txt', 'w', encoding='utf-8') as f:
-    analyzer.print_tree(f)
+    # Generate outputs
+    analyzer.generate_tree_report('dependency_tree.json')
+    with open('dependency_tree.txt', 'w', encoding='utf-8') as f:
+        analyzer.print_tree(f)
 
-print('Done!')
+    print('Done!')
 
 
-current_dir = os.getcwd()
+    current_dir = os.getcwd()
 
-# After your existing analysis
-analyzer.analyze_database()
-analyzer.analyze_file(os.path.join(current_dir, 'dependency_tree.json'))
+    # After your existing analysis
+    analyzer.analyze_database()
+    analyzer.analyze_file(os.path.join(current_dir, 'dependency_tree.json'))
 
-# Generate the unused tables report
-with open('unused_tables_report.txt', 'w', encoding='utf-8') as f:
-    analyzer.print_unused_tables_report(f)
\ No newline at end of file
+    # Generate the unused tables report
+    with open('unused_tables_report.txt', 'w', encoding='utf-8') as f:
+        analyzer.print_unused_tables_report(f)
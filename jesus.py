@@ -1,39 +1,223 @@
 import re
 import json
+import pickle
 import pyodbc
 from pathlib import Path
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 import os
 
+try:
+    import orjson  # Optional; much faster than json for the dependency report
+except ImportError:
+    orjson = None
+
+# Bump when scanning changes so save_cache results from older versions are ignored
+FILE_CACHE_VERSION = 2
+
+# Regexes for stored procedure calls in script function bodies (bytes, matched
+# against raw file contents)
+SP_PATTERNS = [
+    # Original stp patterns
+    rb'system\.db\.runStoredProcedure\(["\']stp[._](\w+)',
+    rb'system\.db\.runPrepStmt\(["\']EXEC\s+stp[._](\w+)',
+    rb'system\.db\.runQuery\(["\']EXEC\s+stp[._](\w+)',
+    rb'\bEXEC\s+stp[._](\w+)',
+    rb'["\']stp[._](\w+)["\']',
+    
+    # createSProcCall pattern
+    rb'system\.db\.createSProcCall\(["\'](?:[\w.]+\.)?(\w+)',  # Will match oee.stp_getGroupOEE_AQP
+    
+    # Mes module patterns
+    rb'\bmes\.[\w.]+\.(?:sp|stp|sproc)\.(\w+)\(',  # matches mes.oee.sp.getPeriodAllLinesOEE_AQP, .stp. and .sproc. variations
+    
+    # Direct sp/stp calls
+    rb'\b(?:sp|stp|sproc)\.(\w+)\(',
+    
+    # System db patterns
+    rb'system\.db\.runProcedure\(["\'](\w+)',
+    rb'system\.db\.runStoredProcedure\(["\'](\w+)',
+    
+    # Additional Ignition patterns
+    rb'\.callProcedure\(["\'](\w+)',
+    rb'\.storedProcedure\(["\'](\w+)'
+]
+
+# Pieces of SQL_TOKEN_PATTERN: a possibly qualified table name ([db].[schema].table,
+# db..table, #temp), and the whitespace/comments allowed between tokens
+SQL_NAME_PATTERN = r'(?:#{0,2}\w+|\[[^\]]*\])(?:\s*\.+\s*(?:\w+|\[[^\]]*\]))*'
+SQL_GAP_PATTERN = r'(?:\s|--[^\n]*|/\*.*?\*/)+'
+
+# Old-style table hints, e.g. FROM t (NOLOCK), which aren't function calls
+SQL_TABLE_HINTS = (
+    'NOLOCK|READUNCOMMITTED|READCOMMITTED|REPEATABLEREAD|SERIALIZABLE|UPDLOCK|'
+    'ROWLOCK|PAGLOCK|TABLOCKX?|HOLDLOCK|XLOCK|READPAST|NOEXPAND|INDEX|FORCESEEK'
+)
+
+# Tokenizer for stored procedure definitions. Comments and string literals
+# are consumed whole so nothing inside them is read as a table reference.
+# The named groups are the tokens _find_table_references acts on.
+SQL_TOKEN_PATTERN = (
+    r'--[^\n]*'  # Single-line comments
+    r'|/\*.*?\*/'  # Multi-line comments
+    r"|'[^']*(?:''[^']*)*'"  # Single quotes
+    r'|"[^"]*(?:""[^"]*)*"'  # Double quotes
+    # FROM/JOIN source; a following ( other than a table hint means a table-valued function
+    rf'|\b(?:FROM|JOIN){SQL_GAP_PATTERN}(?P<source>{SQL_NAME_PATTERN})'
+    rf'(?P<call>\s*\((?!\s*(?:{SQL_TABLE_HINTS})\b))?'
+    # INTO (INSERT INTO, SELECT ... INTO) and UPDATE targets
+    rf'|\b(?:INTO|UPDATE){SQL_GAP_PATTERN}(?P<target>{SQL_NAME_PATTERN})'
+    rf'|\bCREATE{SQL_GAP_PATTERN}TABLE{SQL_GAP_PATTERN}(?P<temp>#{{1,2}}\w+)'
+    # CTE definitions (WITH name AS ( / , name (cols) AS (), excluded from the result
+    r'|(?:\bWITH|,)\s*(?P<cte>\w+)(?:\s*\([^()]*\))?\s+AS\s*\('
+)
+
+# Extra tokens used to work out where a CTE name is in scope: parentheses,
+# and the ends of the statement that defines it (a semicolon, or a keyword that can
+# only start a new statement)
+SQL_SCOPE_PATTERN = SQL_TOKEN_PATTERN + (
+    r'|(?P<open>\()|(?P<close>\))'
+    r'|(?P<end>;|\b(?:BEGIN|DECLARE|IF|WHILE|EXEC(?:UTE)?|RETURN|PRINT|CREATE|DROP|TRUNCATE|GO)\b)'
+)
+
+# Lowercased words that follow those keywords but aren't table names
+EXCLUDED_TABLE_NAMES = frozenset({
+    'dbo', 'into', 'from', 'join', 'update', 'insert', 'where', 'and', 'or',
+    'null', 'not', 'as', 'on', 'with', 'set', 'table', 'values', 'output'
+})
+
+# Compiled once at import and shared by every analyzer, including the copies
+# in worker processes. SP_PATTERNS become a single alternation so every body
+# is scanned once, each alternative under its own label group. The leading
+# lookahead on the patterns' possible first characters lets the matcher skip
+# most positions without trying every alternative.
+_SP_RE = re.compile(
+    rb'(?=["\'.ems])(?:'
+    + b'|'.join(b'(?P<g%d>%s)' % (i, p) for i, p in enumerate(SP_PATTERNS))
+    + b')',
+    re.IGNORECASE
+)
+# Each alternative's SP name is the group right after its label group
+_SP_NAME_GROUPS = {label: index + 1 for label, index in _SP_RE.groupindex.items()}
+# Same lookahead trick, on the first characters SQL_TOKEN_PATTERN can match
+_SQL_TOKEN_RE = re.compile(
+    '(?=[-/\'"fjiucw,])(?:' + SQL_TOKEN_PATTERN + ')',
+    re.IGNORECASE | re.DOTALL
+)
+# Definitions with a CTE are tokenized again with the scope tokens
+_SQL_SCOPE_RE = re.compile(
+    '(?=[-/\'"fjiucw,();bdeprtg])(?:' + SQL_SCOPE_PATTERN + ')',
+    re.IGNORECASE | re.DOTALL
+)
+_DEF_RE = re.compile(rb'\s*(?:async\s+)?def\s+([a-zA-Z_][a-zA-Z0-9_]*)')
+# Outside a multi-line string: comments and single-line string literals are
+# consumed whole so a triple quote inside them doesn't start a string
+_CODE_QUOTE_RE = re.compile(
+    rb'"""|\'\'\'|#.*'
+    rb'|"(?:[^"\\\r\n]|\\.)*"|\'(?:[^\'\\\r\n]|\\.)*\''
+)
+# Inside one: the quote that closes it, skipping escaped characters
+_STRING_END_RES = {
+    b'"""': re.compile(rb'\\.|"""'),
+    b"'''": re.compile(rb"\\.|'''"),
+}
+
+# Line prefixes for print_tree
+TREE_FILE = "\n📄 "
+TREE_FUNCTION = "  ├─📊 Function: "
+TREE_SP = "  │  ├─💾 SP: "
+TREE_TABLE = "  │  │  ├─🗃️ Table: "
+TREE_LAST_TABLE = "  │  │  └─🗃️ Table: "
+TREE_NO_TABLES = "  │  │  └─(No tables found)"
+TREE_NO_SPS = "  │  └─(No stored procedures found)"
+
 class ScriptFinder:
     def __init__(self):
         self.target_extensions = {'.py', '.python', '.js', '.jsx'}
 
-    def find_scripts(self, path):
-        """Find Python and JavaScript files and return minimal info"""
+    def _scan_dir(self, directory, base_len):
+        """List one directory's matching scripts and the subdirectories to walk"""
+        scripts = []
+        subdirs = []
+        extensions = self.target_extensions
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            return scripts, subdirs  # Unreadable directory, skipped like os.walk does
+        
+        with entries:
+            try:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False  # Like os.walk, treat it as a file
+                    if is_dir:
+                        try:
+                            is_symlink = entry.is_symlink()
+                        except OSError:
+                            is_symlink = False
+                        # Directory symlinks are neither followed nor listed (os.walk default)
+                        if not is_symlink:
+                            subdirs.append(entry.path)
+                        continue
+                    
+                    name = entry.name
+                    dot = name.rfind('.')
+                    if dot > 0 and name[dot:].lower() in extensions:
+                        scripts.append({
+                            'f': name,  # filename
+                            'p': entry.path[base_len:]  # relative path
+                        })
+            except OSError:
+                return [], []  # Listing failed part way; os.walk skips the directory too
+        
+        return scripts, subdirs
+
+    def find_scripts(self, path, max_workers=None):
+        """Find Python and JavaScript files and return minimal info
+
+        With max_workers, directories are listed on that many threads.
+        """
         path = Path(path)
         if not path.exists():
             raise FileNotFoundError(f"Path does not exist: {path}")
         
         scripts = []
+        # Entry paths all start with the base path, so relative paths are a slice
+        base_len = len(os.path.join(path, ''))
         
-        for root, _, files in os.walk(path):
-            for file in files:
-                file_path = Path(root) / file
-                if file_path.suffix.lower() in self.target_extensions:
-                    scripts.append({
-                        'f': file,  # filename
-                        'p': str(file_path.relative_to(path))  # relative path
-                    })
+        if not max_workers:
+            stack = [str(path)]
+            while stack:
+                dir_scripts, subdirs = self._scan_dir(stack.pop(), base_len)
+                scripts.extend(dir_scripts)
+                stack.extend(subdirs)
+        else:
+            # For slow or network storage: listing a directory mostly waits on
+            # I/O with the GIL released, so list several at once and queue
+            # subdirectories as each listing finishes. On local disks the
+            # sequential walk is faster.
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                pending = {executor.submit(self._scan_dir, str(path), base_len)}
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        dir_scripts, subdirs = future.result()
+                        scripts.extend(dir_scripts)
+                        pending.update(
+                            executor.submit(self._scan_dir, subdir, base_len)
+                            for subdir in subdirs
+                        )
         
         return sorted(scripts, key=lambda x: x['p'])
 
-    def generate_json(self, path, output_file=None):
-        """Generate minimal JSON output"""
+    def generate_json(self, path, output_file=None, max_workers=None):
+        """Generate minimal JSON output, see find_scripts for max_workers"""
         try:
             result = {
                 'b': str(Path(path).absolute()),  # base path
-                's': self.find_scripts(path)  # scripts
+                's': self.find_scripts(path, max_workers)  # scripts
             }
             
             json_str = json.dumps(result, separators=(',', ':'))
@@ -54,17 +238,19 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Find scripts')
     parser.add_argument('path', help='Directory to search')
     parser.add_argument('-o', '--output', help='Output file')
+    parser.add_argument('-w', '--workers', type=int,
+                        help='List directories on this many threads (for slow or network storage)')
     
     args = parser.parse_args()
     
     finder = ScriptFinder()
-    json_output = finder.generate_json(args.path, args.output)
+    json_output = finder.generate_json(args.path, args.output, args.workers)
     
     if json_output and not args.output:
         print(json_output)
 
 class DependencyAnalyzer:
-    def __init__(self, base_path, connection_string):
+    def __init__(self, base_path, connection_string, cache_file=None):
         self.base_path = Path(base_path)
         self.conn_str = connection_string
         self.dependencies = {
@@ -73,140 +259,214 @@ class DependencyAnalyzer:
             'sp_to_tables': {},
             'function_to_sp': {}
         }
+        # Per-file scan results from earlier runs: full path -> ((mtime, size), functions, function_to_sp)
+        self.cache_file = cache_file
+        self._file_cache = self._load_file_cache() if cache_file else {}
 
     def _analyze_function_content(self, content):
         """Analyze function content for stored procedure calls"""
-        sp_patterns = [
-            # Original stp patterns
-            r'system\.db\.runStoredProcedure\(["\'](?:stp\.|stp_)(\w+)',
-            r'system\.db\.runPrepStmt\(["\']EXEC\s+(?:stp\.|stp_)(\w+)',
-            r'system\.db\.runQuery\(["\']EXEC\s+(?:stp\.|stp_)(\w+)',
-            r'EXEC\s+(?:stp\.|stp_)(\w+)',
-            r'["\'](?:stp\.|stp_)(\w+)["\']',
-            
-            # createSProcCall pattern
-            r'system\.db\.createSProcCall\(["\'](?:[\w.]+\.)?(\w+)',  # Will match oee.stp_getGroupOEE_AQP
-            
-            # Mes module patterns
-            r'mes\.[\w.]+\.sp\.(\w+)\(',  # matches mes.oee.sp.getPeriodAllLinesOEE_AQP
-            r'mes\.[\w.]+\.stp\.(\w+)\(',  # variation with stp
-            r'mes\.[\w.]+\.sproc\.(\w+)\(',  # variation with sproc
-            
-            # Direct sp/stp calls
-            r'sp\.(\w+)\(',
-            r'stp\.(\w+)\(',
-            r'sproc\.(\w+)\(',
-            
-            # System db patterns
-            r'system\.db\.runProcedure\(["\'](\w+)',
-            r'system\.db\.runStoredProcedure\(["\'](\w+)',
-            
-            # Additional Ignition patterns
-            r'\.callProcedure\(["\'](\w+)',
-            r'\.storedProcedure\(["\'](\w+)'
-        ]
-        
         found_sps = set()
-        for pattern in sp_patterns:
-            matches = re.finditer(pattern, content, re.IGNORECASE)
-            for match in matches:
-                sp_name = match.group(1)
-                # Handle cases where the schema (e.g., 'oee.') is part of the name
-                if '.' in sp_name:
-                    sp_name = sp_name.split('.')[-1]
+        for match in _SP_RE.finditer(content):
+            # lastgroup is the label of the alternative that matched; the captured
+            # name is \w+, so it never includes a schema prefix
+            sp_name = match.group(_SP_NAME_GROUPS[match.lastgroup]).decode('ascii')
+            
+            # If it doesn't start with stp_ and isn't a fully qualified name, add the prefix
+            if not sp_name.startswith(('stp_', 'stp.')):
+                sp_name = f"stp_{sp_name}"
                 
-                # If it doesn't start with stp_ and isn't a fully qualified name, add the prefix
-                if not sp_name.startswith(('stp_', 'stp.')):
-                    sp_name = f"stp_{sp_name}"
-                    
-                found_sps.add(sp_name)
+            found_sps.add(sp_name)
         
         return list(found_sps)
 
     def _extract_functions_with_content(self, file_content):
         """Extract both function names and their content"""
         functions = {}
-        current_function = None
-        current_content = []
-        indent_level = 0
+        open_functions = []  # (name, indent, first line) for defs whose body is still being read
+        string_quote = None  # Triple quote of a string that spans lines, if inside one
         
-        lines = file_content.split('\n')
-        i = 0
-        while i < len(lines):
-            line = lines[i]
-            stripped = line.strip()
-            
-            # Check for function definition
-            if stripped.startswith('def '):
-                # If we were tracking a previous function, save it
-                if current_function:
-                    functions[current_function] = '\n'.join(current_content)
+        lines = file_content.split(b'\n')
+        for i, line in enumerate(lines):
+            if string_quote is None:
+                code = line.lstrip()
                 
-                # Start new function
-                func_match = re.match(r'\s*def\s+([a-zA-Z_][a-zA-Z0-9_]*)', line)
-                if func_match:
-                    current_function = func_match.group(1)
-                    current_content = [line]
-                    indent_level = len(line) - len(line.lstrip())
+                # Code outside strings/comments at or left of a def's indent ends that def
+                if code and not code.startswith(b'#'):
+                    indent_level = len(line) - len(code)
+                    while open_functions and indent_level <= open_functions[-1][1]:
+                        func_name, _, start = open_functions.pop()
+                        # Nested defs stay part of the enclosing function's content
+                        functions[func_name] = b'\n'.join(lines[start:i])
                     
-                    # Include docstring if present
-                    i += 1
-                    while i < len(lines) and (not lines[i].strip() or lines[i].lstrip().startswith('"""')):
-                        current_content.append(lines[i])
-                        if lines[i].lstrip().startswith('"""'):
-                            # Skip until end of docstring
-                            if not lines[i].strip().endswith('"""'):
-                                i += 1
-                                while i < len(lines) and '"""' not in lines[i]:
-                                    current_content.append(lines[i])
-                                    i += 1
-                                if i < len(lines):
-                                    current_content.append(lines[i])
-                        i += 1
-                    i -= 1  # Adjust for outer loop increment
-                    
-            # Add content to current function
-            elif current_function and line:
-                line_indent = len(line) - len(line.lstrip())
-                if not stripped or line_indent > indent_level:
-                    current_content.append(line)
-                else:
-                    # End of function reached
-                    functions[current_function] = '\n'.join(current_content)
-                    current_function = None
-                    current_content = []
+                    if code.startswith((b'def ', b'async def ')):
+                        func_match = _DEF_RE.match(line)
+                        if func_match:
+                            func_name = func_match.group(1).decode('ascii')
+                            functions.setdefault(func_name, b'')  # Keep source order
+                            open_functions.append((func_name, indent_level, i))
             
-            i += 1
+            # Track multi-line strings (docstrings, embedded SQL) so their dedented
+            # lines don't end the function
+            if b'"""' in line or b"'''" in line:
+                string_quote = self._string_state_after(line, string_quote)
         
-        # Save last function if exists
-        if current_function:
-            functions[current_function] = '\n'.join(current_content)
+        # Save functions still open at end of file
+        for func_name, _, start in open_functions:
+            functions[func_name] = b'\n'.join(lines[start:])
         
         return functions
 
-    def analyze_file(self, file_path):
-        """Analyze a single Python file for functions and SP references"""
+    def _string_state_after(self, line, string_quote):
+        """Return the triple quote of a string still open at the end of line, or None"""
+        pos = 0
+        while True:
+            if string_quote is not None:
+                for match in _STRING_END_RES[string_quote].finditer(line, pos):
+                    if match.group() == string_quote:
+                        break
+                else:
+                    return string_quote
+                string_quote = None
+                pos = match.end()
+            
+            match = _CODE_QUOTE_RE.search(line, pos)
+            if match is None:
+                return None
+            token = match.group()
+            if token in _STRING_END_RES:
+                string_quote = token
+            elif token.startswith(b'#'):
+                return None
+            pos = match.end()
+
+    def _scan_file(self, file_path):
+        """Extract functions and their SP references from a file without touching dependencies"""
         full_path = self.base_path / file_path
+        functions = {}
+        function_sps = {}
         try:
-            with open(full_path, 'r', encoding='utf-8') as f:
+            # Patterns are ASCII, so match the raw bytes and skip decoding the file
+            with open(full_path, 'rb') as f:
                 content = f.read()
             
             # Extract functions and their content
             functions = self._extract_functions_with_content(content)
-            if functions:
-                self.dependencies['functions'][file_path] = functions
             
             # Find SP references in each function
             for func_name, func_content in functions.items():
                 stored_procs = self._analyze_function_content(func_content)
                 if stored_procs:
-                    if file_path not in self.dependencies['function_to_sp']:
-                        self.dependencies['function_to_sp'][file_path] = {}
-                    self.dependencies['function_to_sp'][file_path][func_name] = stored_procs
-                    self.dependencies['stored_procedures'].update(stored_procs)
+                    function_sps[func_name] = stored_procs
         
         except Exception as e:
             print(f"Error processing {file_path}: {str(e)}")
+            functions = None  # Not cached, so the file is retried next run
+            function_sps = {}
+        
+        return file_path, functions, function_sps
+
+    def _merge_file_result(self, file_path, functions, function_sps):
+        """Record the results of _scan_file in dependencies"""
+        if functions:
+            self.dependencies['functions'][file_path] = functions
+        
+        if function_sps:
+            file_sps = set()
+            file_function_sps = self.dependencies['function_to_sp'].setdefault(file_path, {})
+            for func_name, stored_procs in function_sps.items():
+                file_function_sps[func_name] = stored_procs
+                file_sps.update(stored_procs)
+            # One update per file rather than per function
+            self.dependencies['stored_procedures'] |= file_sps
+
+    def _file_signature(self, file_path):
+        """Return (mtime, size) used to tell whether a cached scan is still valid"""
+        try:
+            st = os.stat(self.base_path / file_path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _get_cached_result(self, file_path, signature):
+        """Return the cached _scan_file result for an unchanged file, else None"""
+        entry = self._file_cache.get(str(self.base_path / file_path))
+        if signature is None or entry is None or entry[0] != signature:
+            return None
+        return file_path, entry[1], entry[2]
+
+    def _cache_result(self, result, signature):
+        """Remember a _scan_file result for the file's current signature"""
+        file_path, functions, function_sps = result
+        if self.cache_file and signature is not None and functions is not None:
+            self._file_cache[str(self.base_path / file_path)] = (signature, functions, function_sps)
+
+    def _load_file_cache(self):
+        """Load per-file scan results saved by save_cache"""
+        if not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, 'rb') as f:
+                cache = pickle.load(f)
+            # Results from an older scanner may be wrong, so start fresh
+            if cache.get('version') != FILE_CACHE_VERSION:
+                return {}
+            return cache['files']
+        except Exception as e:
+            print(f"Error loading file cache: {str(e)}")
+            return {}
+
+    def save_cache(self):
+        """Save per-file scan results so unchanged files are skipped next run"""
+        if not self.cache_file:
+            return
+        try:
+            with open(self.cache_file, 'wb') as f:
+                pickle.dump(
+                    {'version': FILE_CACHE_VERSION, 'files': self._file_cache},
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL
+                )
+        except Exception as e:
+            print(f"Error saving file cache: {str(e)}")
+
+    def analyze_file(self, file_path):
+        """Analyze a single Python file for functions and SP references"""
+        signature = self._file_signature(file_path)
+        result = self._get_cached_result(file_path, signature)
+        if result is None:
+            result = self._scan_file(file_path)
+            self._cache_result(result, signature)
+        self._merge_file_result(*result)
+
+    def analyze_files(self, file_paths, max_workers=None):
+        """Analyze many Python files across worker processes"""
+        file_paths = list(file_paths)
+        signatures = [self._file_signature(file_path) for file_path in file_paths]
+        results = [
+            self._get_cached_result(file_path, signature)
+            for file_path, signature in zip(file_paths, signatures)
+        ]
+        
+        # Only files that changed since the cache was written need scanning
+        misses = [i for i, result in enumerate(results) if result is None]
+        if misses:
+            with ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=_init_worker,
+                initargs=(str(self.base_path),)
+            ) as executor:
+                scanned = executor.map(
+                    _scan_file_worker,
+                    [file_paths[i] for i in misses],
+                    chunksize=32
+                )
+                for i, result in zip(misses, scanned):
+                    results[i] = result
+                    self._cache_result(result, signatures[i])
+        
+        # Merge in input order, as if analyzed sequentially
+        for result in results:
+            self._merge_file_result(*result)
 
     def analyze_database(self):
         """Connect to SQL Server and analyze stored procedures"""
@@ -214,22 +474,27 @@ class DependencyAnalyzer:
             with pyodbc.connect(self.conn_str) as conn:
                 cursor = conn.cursor()
                 
+                # Filter on sys.procedures.name so definitions are only fetched for stp procs
                 cursor.execute("""
+                    SET NOCOUNT ON;
                     SELECT 
-                        OBJECT_NAME(object_id) as proc_name,
+                        name as proc_name,
                         OBJECT_DEFINITION(object_id) as proc_definition
                     FROM sys.procedures
-                    WHERE OBJECT_NAME(object_id) LIKE 'stp[_.]%'
+                    WHERE name LIKE 'stp[_.]%'
                 """)
                 
-                for row in cursor.fetchall():
+                # Iterate the cursor rather than fetchall() so definitions are
+                # parsed as they arrive instead of all being held in memory
+                for row in cursor:
                     proc_name = row.proc_name
                     proc_def = row.proc_definition
                     
                     self.dependencies['stored_procedures'].add(proc_name)
                     tables = self._find_table_references(proc_def)
                     if tables:
-                        self.dependencies['sp_to_tables'][proc_name] = list(tables)
+                        # Already sorted, so the report can use it as-is
+                        self.dependencies['sp_to_tables'][proc_name] = tables
         
         except Exception as e:
             print(f"Database connection error: {str(e)}")
@@ -237,47 +502,73 @@ class DependencyAnalyzer:
     def _find_table_references(self, sql_text):
         """Extract table references from SQL text while avoiding false positives."""
         tables = set()
-        # Remove comments
-        sql_text = re.sub(r'--.*', '', sql_text)  # Single-line comments
-        sql_text = re.sub(r'/\*.*?\*/', '', sql_text, flags=re.DOTALL)  # Multi-line comments
-    
-        # Remove string literals
-        sql_text = re.sub(r"'([^']|'')*'", '', sql_text)  # Single quotes
-        sql_text = re.sub(r'"([^"]|"")*"', '', sql_text)  # Double quotes
-    
-        # Define patterns for table references
-        table_patterns = [
-            r'\bFROM\s+([\w\.\[\]]+)',  # FROM clause
-            r'\bJOIN\s+([\w\.\[\]]+)',  # JOIN clause
-            r'\bINTO\s+([\w\.\[\]]+)',  # INTO clause
-            r'\bUPDATE\s+([\w\.\[\]]+)',  # UPDATE clause
-            r'\bINSERT\s+INTO\s+([\w\.\[\]]+)',  # INSERT INTO clause
-        ]
-    
-        # Exclude list for common false positives
-        exclude_list = {
-            'dbo', 'INTO', 'FROM', 'JOIN', 'UPDATE', 'INSERT', 'WHERE', 'AND', 'OR', 
-            'NULL', 'NOT', 'AS', 'ON', 'WITH', 'SET', 'TABLE', 'VALUES', 'OUTPUT'
-        }
-    
-        # Extract table names
-        for pattern in table_patterns:
-            matches = re.finditer(pattern, sql_text, re.IGNORECASE)
-            for match in matches:
-                table_ref = match.group(1).strip()
-                # Handle schema.table or [schema].[table] format
-                if '.' in table_ref or '[' in table_ref:
-                    parts = re.split(r'[.\[\]]+', table_ref)
-                    table_name = parts[-1]  # Extract table name
-                    if table_name.lower() not in exclude_list:
-                        tables.add(table_name)
-                else:
-                    if table_ref.lower() not in exclude_list:
-                        tables.add(table_ref)
-    
-        # Return sorted and deduplicated tables
+        
+        # Single pass over the definition
+        for match in _SQL_TOKEN_RE.finditer(sql_text):
+            kind = match.lastgroup
+            if kind is None or kind == 'call':
+                continue  # Comment, string literal, or table-valued function
+            if kind == 'cte':
+                return self._find_table_references_with_ctes(sql_text)
+            
+            table_ref = self._table_name(match.group(kind))
+            if table_ref:
+                tables.add(table_ref)
+        
         return sorted(tables)
 
+    def _find_table_references_with_ctes(self, sql_text):
+        """_find_table_references for definitions that may define CTEs
+
+        A CTE name only hides references in its own statement, after its body
+        and up to the end of the statement. Anywhere else, including inside
+        its own body, the same name is a real table.
+        """
+        tables = set()
+        depth = 0  # Parenthesis nesting
+        with_depth = None  # Depth of the current WITH statement, if in one
+        visible = set()  # Lowercased CTEs of that statement whose bodies are done
+        defining = None  # (lowercased name, depth) of the CTE body being read
+        for match in _SQL_SCOPE_RE.finditer(sql_text):
+            kind = match.lastgroup
+            if kind is None:
+                continue
+            if kind == 'open' or kind == 'call':  # A call token ends with its (
+                depth += 1
+            elif kind == 'close':
+                depth = max(depth - 1, 0)
+                if defining is not None and depth == defining[1]:
+                    visible.add(defining[0])
+                    defining = None
+                elif with_depth is not None and depth < with_depth:
+                    with_depth, visible, defining = None, set(), None
+            elif kind == 'cte':
+                starts_statement = not match.group().startswith(',')
+                if starts_statement or with_depth == depth:
+                    if starts_statement:
+                        with_depth, visible = depth, set()
+                    defining = (match.group(kind).lower(), depth)
+                depth += 1  # A CTE token ends with the ( of its body
+            elif kind == 'end' or kind == 'temp':  # CREATE TABLE starts a statement too
+                if with_depth is not None and depth <= with_depth:
+                    with_depth, visible, defining = None, set(), None
+            
+            if kind in ('source', 'target', 'temp'):
+                table_ref = self._table_name(match.group(kind))
+                if table_ref and table_ref.lower() not in visible:
+                    tables.add(table_ref)
+        
+        return sorted(tables)
+
+    def _table_name(self, table_ref):
+        """Return the table part of a reference, or None if it isn't a table"""
+        # Handle schema.table or [schema].[table] format
+        if '.' in table_ref or '[' in table_ref:
+            table_ref = table_ref.rsplit('.', 1)[-1].strip().strip('[]')
+        if table_ref and table_ref.lower() not in EXCLUDED_TABLE_NAMES:
+            return table_ref
+        return None
+
 
     def load_existing_sp_data(self, filename):
         """Load existing stored procedure data from file"""
@@ -286,89 +577,100 @@ class DependencyAnalyzer:
                 existing_deps = json.load(f)
                 
             sp_to_tables = {
-                k if k.startswith(('stp.', 'stp_')) else f"stp_{k}": v 
+                k if k.startswith(('stp.', 'stp_')) else f"stp_{k}": sorted(v)
                 for k, v in existing_deps.get('sp_to_tables', {}).items()
             }
             self.dependencies['sp_to_tables'].update(sp_to_tables)
         except Exception as e:
             print(f"Error loading existing SP data: {str(e)}")
 
-    def generate_tree_report(self, output_file=None):
-        """Generate a hierarchical tree report of dependencies"""
-        tree = {}
+    def _iter_file_nodes(self):
+        """Yield (file_path, file_node) for each file in the tree report"""
+        sp_to_tables = self.dependencies['sp_to_tables']  # Table lists are kept sorted
         
         for file_path, functions in self.dependencies['functions'].items():
+            file_function_sps = self.dependencies['function_to_sp'].get(file_path, {})
             file_node = {
                 'type': 'file',
                 'functions': {}
             }
             
-            for func_name, func_content in functions.items():
+            for func_name in functions:
                 function_node = {
                     'type': 'function',
                     'stored_procedures': {}
                 }
                 
-                if (file_path in self.dependencies['function_to_sp'] and 
-                    func_name in self.dependencies['function_to_sp'][file_path]):
-                    
-                    for sp_name in self.dependencies['function_to_sp'][file_path][func_name]:
-                        sp_node = {
-                            'type': 'stored_procedure',
-                            'tables': sorted(self.dependencies['sp_to_tables'].get(sp_name, []))  # Sort tables
-                        }
-                        function_node['stored_procedures'][sp_name] = sp_node
+                for sp_name in file_function_sps.get(func_name, []):
+                    sp_node = {
+                        'type': 'stored_procedure',
+                        'tables': sp_to_tables.get(sp_name, [])
+                    }
+                    function_node['stored_procedures'][sp_name] = sp_node
                 
                 file_node['functions'][func_name] = function_node
             
-            tree[file_path] = file_node
-        
-        report = {
-            'type': 'dependency_tree',
-            'files': tree
-        }
+            yield file_path, file_node
+
+    def generate_tree_report(self, output_file=None):
+        """Return the dependency tree report, or stream it to output_file and return the file count
+
+        With output_file the report is written one file node at a time, so
+        the whole tree is never held in memory; the number of file nodes
+        written is returned instead of the report.
+        """
+        if not output_file:
+            return {
+                'type': 'dependency_tree',
+                'files': dict(self._iter_file_nodes())
+            }
         
-        if output_file:
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(report, f, indent=2)
+        # Same layout as json.dump(report, f, indent=2), written per file node
+        with open(output_file, 'wb') as f:
+            f.write(b'{\n  "type": "dependency_tree",\n  "files": {')
+            separator = b'\n'
+            file_count = 0
+            for file_count, (file_path, file_node) in enumerate(self._iter_file_nodes(), 1):
+                f.write(
+                    separator + b'    ' + _dump_json(file_path) + b': '
+                    + _dump_json(file_node).replace(b'\n', b'\n    ')
+                )
+                separator = b',\n'
+            f.write(b'}\n}' if separator == b'\n' else b'\n  }\n}')
         
-        return report
+        return file_count
 
     def print_tree(self, output_file=None):
         """Print a human-readable tree visualization"""
-        tree = self.generate_tree_report()
-        output_lines = []
+        output_lines = ["Dependency Tree:", "================"]
+        append = output_lines.append
         
-        def write_line(line):
-            if output_file:
-                print(line, file=output_file)
-            output_lines.append(line)
-        
-        write_line("Dependency Tree:")
-        write_line("================")
-        
-        for file_path, file_data in tree['files'].items():
-            write_line(f"\n📄 {file_path}")
+        for file_path, file_data in self._iter_file_nodes():
+            append(TREE_FILE + file_path)
             
             for func_name, func_data in file_data['functions'].items():
-                write_line(f"  ├─📊 Function: {func_name}")
+                append(TREE_FUNCTION + func_name)
                 
                 if func_data['stored_procedures']:
                     for sp_name, sp_data in func_data['stored_procedures'].items():
-                        write_line(f"  │  ├─💾 SP: {sp_name}")
+                        append(TREE_SP + sp_name)
                         
-                        if sp_data['tables']:
-                            for i, table in enumerate(sp_data['tables'], 1):
-                                is_last = i == len(sp_data['tables'])
-                                prefix = "  │  │  └─" if is_last else "  │  │  ├─"
-                                # Keep # prefix for temp tables in output
-                                write_line(f"{prefix}🗃️ Table: {table}")
+                        tables = sp_data['tables']
+                        if tables:
+                            # Keep # prefix for temp tables in output
+                            output_lines.extend([TREE_TABLE + table for table in tables[:-1]])
+                            append(TREE_LAST_TABLE + tables[-1])
                         else:
-                            write_line("  │  │  └─(No tables found)")
+                            append(TREE_NO_TABLES)
                 else:
-                    write_line("  │  └─(No stored procedures found)")
+                    append(TREE_NO_SPS)
         
-        return "\n".join(output_lines)
+        tree_text = "\n".join(output_lines)
+        if output_file:
+            # One write instead of a print() per line
+            output_file.write(tree_text + "\n")
+        
+        return tree_text
     
     def analyze_unused_tables(self):
         """Find tables not referenced by any stored procedures and check if they contain data"""
@@ -431,4 +733,23 @@ class DependencyAnalyzer:
             write_line(f"  ├─ Has Data: {'✅' if status['has_data'] else '❌'}")
             write_line(f"  └─ Row Count: {status['row_count']:,}")
         
-        return "\n".join(output_lines)
\ No newline at end of file
+        return "\n".join(output_lines)
+
+
+def _dump_json(obj):
+    """Serialize obj as 2-space indented JSON bytes, with orjson if available"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode('utf-8')
+
+# Analyzer used by each worker process of DependencyAnalyzer.analyze_files
+_worker_analyzer = None
+
+def _init_worker(base_path):
+    """Create the worker process's analyzer once instead of per file"""
+    global _worker_analyzer
+    _worker_analyzer = DependencyAnalyzer(base_path, None)
+
+def _scan_file_worker(file_path):
+    """Scan one file in a worker process"""
+    return _worker_analyzer._scan_file(file_path)
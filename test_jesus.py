@@ -0,0 +1,67 @@
+import pytest
+
+pytest.importorskip('pyodbc')  # jesus imports it at module level
+
+from jesus import DependencyAnalyzer, ScriptFinder
+
+
+def function_sps(source):
+    analyzer = DependencyAnalyzer('.', '')
+    functions = analyzer._extract_functions_with_content(source.encode('utf-8'))
+    return {
+        name: sorted(analyzer._analyze_function_content(content))
+        for name, content in functions.items()
+    }
+
+
+@pytest.mark.parametrize('line', [
+    "    x = '\"\"\"'",
+    '    y = "\'\'\'"',
+    '    # a stray """ in a comment',
+])
+def test_triple_quote_in_string_or_comment(line):
+    source = (
+        'def a():\n'
+        + line + '\n'
+        '    system.db.runStoredProcedure("stp_one")\n'
+        '\n'
+        'def b():\n'
+        '    system.db.runStoredProcedure("stp_two")\n'
+    )
+    assert function_sps(source) == {'a': ['stp_one'], 'b': ['stp_two']}
+
+
+def test_multiline_string_dedent_does_not_end_function():
+    source = (
+        'def a():\n'
+        '    query = """\n'
+        'EXEC stp_one\n'
+        '"""  # closes here\n'
+        '    return query\n'
+        '\n'
+        'def b():\n'
+        '    system.db.runStoredProcedure("stp_two")\n'
+    )
+    assert function_sps(source) == {'a': ['stp_one'], 'b': ['stp_two']}
+
+
+@pytest.mark.parametrize('max_workers', [None, 2])
+def test_directory_symlinks_are_not_followed_or_listed(tmp_path, max_workers):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'c').mkdir()
+    (tmp_path / 'c' / 'real.py').write_text('')
+    (tmp_path / 'a' / 'link.py').symlink_to('../c', target_is_directory=True)
+    scripts = ScriptFinder().find_scripts(tmp_path, max_workers)
+    assert scripts == [{'f': 'real.py', 'p': 'c/real.py'}]
+
+
+@pytest.mark.parametrize('sql, tables', [
+    # A CTE named like a table only hides references in its own statement
+    ('SELECT * FROM Orders; ;WITH orders AS (SELECT 1 a) SELECT * FROM orders', ['Orders']),
+    ('WITH Orders AS (SELECT * FROM Orders) SELECT * FROM Orders', ['Orders']),
+    ('WITH c AS (SELECT 1 a) SELECT * FROM c\nDECLARE @x INT\nSELECT * FROM c', ['c']),
+    (';WITH a AS (SELECT * FROM Base), b (x) AS (SELECT x FROM a) SELECT * FROM b JOIN Real r ON 1=1',
+     ['Base', 'Real']),
+])
+def test_cte_names_are_scoped_to_their_statement(sql, tables):
+    assert DependencyAnalyzer('.', '')._find_table_references(sql) == tables